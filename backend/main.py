@@ -1,10 +1,16 @@
 import os
+import sys
 import time
 import uuid
+import hashlib
+import queue
+import shutil
 import threading
+import subprocess
+from array import array
 
 import yt_dlp
-from fastapi import FastAPI, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
@@ -37,7 +43,6 @@ if not os.path.exists(DOWNLOAD_DIR):
 
 # Vérification de FFmpeg (Crucial pour le merge audio/vidéo)
 def check_dependencies():
-    import shutil
     if not shutil.which("ffmpeg"):
         print("\n" + "="*50)
         print("⚠️  WARNING: FFMPEG NOT FOUND  ⚠️")
@@ -62,6 +67,10 @@ class ConnectionManager:
         self.active_connections.remove(websocket)
 
     async def broadcast(self, message: dict):
+        # Feed SSE / long-poll clients with the exact same events
+        if message.get("type") == "progress" and message.get("taskId"):
+            message = dict(message, version=progress_hub.publish(message["taskId"], message))
+
         # Broadcast to all connected clients
         for connection in self.active_connections:
             try:
@@ -73,6 +82,77 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
+# --- PROGRESS HUB (SSE / long-poll for non-WebSocket clients) ---
+class ProgressHub:
+    """Keeps the latest progress event of each task with a per-task version number.
+
+    Events are published from the download threads (each with its own
+    temporary event loop), so state is guarded by a threading lock and
+    waiters on the main loop are woken with call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states: Dict[str, dict] = {}
+        self.versions: Dict[str, int] = {}
+        self.events: Dict[str, asyncio.Event] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def publish(self, task_id: str, message: dict) -> int:
+        with self.lock:
+            version = self.versions.get(task_id, 0) + 1
+            self.versions[task_id] = version
+            # Store the event itself: fields like speed/eta must not outlive the event that set them
+            state = {k: v for k, v in message.items() if k != "type"}
+            state["version"] = version
+            self.states[task_id] = state
+            loop = self.loop
+
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake, task_id)
+        return version
+
+    def _wake(self, task_id: str):
+        event = self.events.pop(task_id, None)
+        if event:
+            event.set()
+
+    def snapshot(self, task_id: str) -> Optional[dict]:
+        with self.lock:
+            state = self.states.get(task_id)
+            return dict(state) if state else None
+
+    def version(self, task_id: str) -> int:
+        with self.lock:
+            return self.versions.get(task_id, 0)
+
+    async def wait(self, task_id: str, since: int, timeout: float) -> Optional[dict]:
+        """Attend une version > since. Retourne l'état courant, ou None au timeout."""
+        self.loop = asyncio.get_running_loop()
+        deadline = self.loop.time() + timeout
+        while True:
+            # Register before checking so a publish in between still wakes us
+            event = self.events.setdefault(task_id, asyncio.Event())
+            if self.version(task_id) > since:
+                return self.snapshot(task_id)
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def forget(self, task_id: str):
+        with self.lock:
+            self.states.pop(task_id, None)
+            self.versions.pop(task_id, None)
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake, task_id)
+
+progress_hub = ProgressHub()
+
+
 # --- GLOBAL STATE (In-Memory Download Manager) ---
 # Structure: { task_id: { "status": "downloading"|"finished"|"error", "progress": 0.0, "filename": "...", "filepath": "...", "title": "..." } }
 download_tasks: Dict[str, dict] = {}
@@ -371,6 +451,552 @@ async def stream_video(url: str):
         raise HTTPException(status_code=400, detail=f"Erreur lors de la récupération : {str(e)}")
 
 
+# --- LIBRARY PREVIEWS (poster, sprite sheet, waveform) ---
+# Previews are generated once per file and cached next to the library so the
+# UI never has to stream the original media just to show a thumbnail.
+PREVIEW_DIR = os.path.join(DOWNLOAD_DIR, ".previews")
+if not os.path.exists(PREVIEW_DIR):
+    os.makedirs(PREVIEW_DIR)
+
+VIDEO_EXTS = ['.mp4', '.mkv', '.webm']
+AUDIO_EXTS = ['.mp3', '.m4a', '.wav']
+
+POSTER_WIDTH = 640
+SPRITE_COLUMNS = 5
+SPRITE_ROWS = 5
+SPRITE_TILE_WIDTH = 160
+WAVEFORM_PEAKS = 1000
+WAVEFORM_SAMPLE_RATE = 8000
+FFMPEG_TIMEOUT = 1800  # seconds: a hung ffmpeg must not block the single library worker
+
+
+def downloads_active() -> bool:
+    return any(t.get('status') in ('downloading', 'processing') for t in list(download_tasks.values()))
+
+
+def low_priority_cmd(cmd: List[str]) -> List[str]:
+    """Préfixe une commande externe pour qu'elle tourne avec la priorité CPU/IO la plus basse."""
+    prefix = []
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    return prefix + cmd
+
+
+class LowPriorityWorker:
+    """Single background thread for library housekeeping jobs.
+
+    Jobs wait until no download is running, and the thread (plus any ffmpeg
+    it spawns) runs at the lowest scheduling priority, so it never competes
+    with active downloads.
+    """
+
+    def __init__(self):
+        self.jobs: "queue.Queue" = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def submit(self, key: str, fn, *args):
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.jobs.put((key, fn, args))
+
+    def _run(self):
+        try:
+            # Linux: niceness is per-thread, so this only affects this worker
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except Exception:
+            pass
+
+        while True:
+            key, fn, args = self.jobs.get()
+            while downloads_active():
+                time.sleep(2)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Background job error ({key}): {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+library_worker = LowPriorityWorker()
+
+
+def preview_paths(filename: str) -> Dict[str, str]:
+    base = os.path.join(PREVIEW_DIR, filename)
+    return {
+        "manifest": base + ".json",
+        "poster": base + ".poster.jpg",
+        "sprite": base + ".sprite.jpg",
+    }
+
+
+def load_preview_manifest(filename: str, stat: Optional[os.stat_result] = None) -> Optional[dict]:
+    """Retourne le manifest en cache, ou None s'il manque ou si le fichier source a changé.
+
+    A failed generation is cached too, as {"error": ..., "source_mtime": ...}.
+    """
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    try:
+        with open(preview_paths(filename)["manifest"], "r") as f:
+            manifest = json.load(f)
+        if stat is None:
+            stat = os.stat(filepath)
+        if manifest.get("source_mtime") != stat.st_mtime_ns:
+            return None
+        return manifest
+    except (OSError, ValueError):
+        return None
+
+
+# filename -> (source_mtime, ok): lets /api/library flag previews without parsing
+# every manifest (audio ones carry the whole peaks array). Kept in sync on write/remove.
+preview_status_cache: Dict[str, tuple] = {}
+
+
+def preview_ready(filename: str, stat: os.stat_result) -> bool:
+    status = preview_status_cache.get(filename)
+    if status is None:
+        try:
+            with open(preview_paths(filename)["manifest"], "r") as f:
+                manifest = json.load(f)
+            status = (manifest.get("source_mtime"), "error" not in manifest)
+        except (OSError, ValueError):
+            status = (None, False)
+        preview_status_cache[filename] = status
+    return status[1] and status[0] == stat.st_mtime_ns
+
+
+def write_preview_manifest(filename: str, manifest: dict):
+    path = preview_paths(filename)["manifest"]
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+    preview_status_cache[filename] = (manifest.get("source_mtime"), "error" not in manifest)
+
+
+def remove_previews(filename: str):
+    preview_status_cache.pop(filename, None)
+    for path in preview_paths(filename).values():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def probe_media(filepath: str) -> dict:
+    result = subprocess.run(
+        low_priority_cmd(["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", filepath]),
+        capture_output=True, text=True, timeout=120
+    )
+    data = json.loads(result.stdout or "{}")
+    duration = float(data.get("format", {}).get("duration") or 0)
+
+    has_audio = any(s.get("codec_type") == "audio" for s in data.get("streams", []))
+    video = None
+    for s in data.get("streams", []):
+        # Skip embedded cover art (MP3/M4A expose it as a video stream)
+        if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic"):
+            video = s
+            break
+
+    width = height = 0
+    if video:
+        width, height = int(video.get("width") or 0), int(video.get("height") or 0)
+        rotation = video.get("tags", {}).get("rotate")
+        for side_data in video.get("side_data_list", []):
+            rotation = side_data.get("rotation", rotation)
+        if rotation is not None and abs(int(float(rotation))) in (90, 270):
+            width, height = height, width
+
+    return {"duration": duration, "has_video": video is not None, "has_audio": has_audio, "width": width, "height": height}
+
+
+def run_ffmpeg(args: List[str], output: str):
+    """Lance ffmpeg vers un fichier temporaire puis le renomme (pas de preview à moitié écrite)."""
+    root, ext = os.path.splitext(output)
+    tmp = f"{root}.tmp{ext}"
+    subprocess.run(
+        low_priority_cmd(["ffmpeg", "-y", "-v", "error", "-threads", "1"] + args + [tmp]),
+        check=True, capture_output=True, timeout=FFMPEG_TIMEOUT
+    )
+    os.replace(tmp, output)
+
+
+def generate_video_preview(filepath: str, paths: Dict[str, str], info: dict) -> dict:
+    duration = info["duration"]
+
+    # Poster: a frame ~10% in (avoids black intros), input seeking is keyframe-fast
+    poster_at = min(duration * 0.1, 10) if duration else 0
+    run_ffmpeg(["-ss", f"{poster_at:.2f}", "-i", filepath, "-frames:v", "1",
+                "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "4"], paths["poster"])
+
+    manifest = {"type": "video", "duration": duration, "poster": True, "sprite": None}
+    if not duration or not info["width"] or not info["height"]:
+        return manifest
+
+    # Sprite sheet: decode keyframes only and pick evenly spaced tiles
+    count = SPRITE_COLUMNS * SPRITE_ROWS
+    interval = duration / count
+    tile_height = max(2, int(round(SPRITE_TILE_WIDTH * info["height"] / info["width"] / 2)) * 2)
+    run_ffmpeg(["-skip_frame", "nokey", "-i", filepath, "-an", "-frames:v", "1",
+                "-vf", f"fps=1/{interval:.4f},scale={SPRITE_TILE_WIDTH}:{tile_height},tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+                "-q:v", "5"], paths["sprite"])
+
+    manifest["sprite"] = {
+        "columns": SPRITE_COLUMNS,
+        "rows": SPRITE_ROWS,
+        "count": count,
+        "interval": interval,
+        "width": SPRITE_TILE_WIDTH,
+        "height": tile_height,
+    }
+    return manifest
+
+
+def merge_peaks(peaks: List[int]) -> List[int]:
+    """Halve a peaks array by keeping the max of each adjacent pair."""
+    return [max(peaks[i:i + 2]) for i in range(0, len(peaks), 2)]
+
+
+def generate_waveform(filepath: str, duration: float) -> List[float]:
+    """Décode l'audio en mono basse fréquence (streamé) et garde le pic de chaque tranche."""
+    total = duration * WAVEFORM_SAMPLE_RATE
+    per_bucket = max(1, int(total / WAVEFORM_PEAKS)) if total else WAVEFORM_SAMPLE_RATE
+
+    proc = subprocess.Popen(
+        low_priority_cmd(["ffmpeg", "-v", "error", "-threads", "1", "-i", filepath, "-vn",
+                          "-ac", "1", "-ar", str(WAVEFORM_SAMPLE_RATE), "-f", "s16le", "-"]),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    # Watchdog: same deadline as run_ffmpeg, killing ffmpeg also unblocks the read loop
+    watchdog = threading.Timer(FFMPEG_TIMEOUT, proc.kill)
+    watchdog.daemon = True
+    watchdog.start()
+
+    peaks = []
+    samples = array('h')
+    leftover = b""
+    try:
+        while True:
+            chunk = proc.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            cut = len(chunk) - (len(chunk) % 2)
+            leftover = chunk[cut:]
+            block = array('h')
+            block.frombytes(chunk[:cut])
+            if sys.byteorder == "big":
+                block.byteswap()
+            samples.extend(block)
+
+            while len(samples) >= per_bucket:
+                bucket = samples[:per_bucket]
+                peaks.append(max(max(bucket), -min(bucket)))
+                del samples[:per_bucket]
+
+                # Unknown/wrong duration: keep the array bounded by doubling the bucket size
+                if len(peaks) >= 2 * WAVEFORM_PEAKS:
+                    peaks = merge_peaks(peaks)
+                    per_bucket *= 2
+        if samples:
+            peaks.append(max(max(samples), -min(samples)))
+    finally:
+        watchdog.cancel()
+        proc.stdout.close()
+        proc.wait()
+
+    if proc.returncode != 0 or not peaks:
+        raise RuntimeError(f"ffmpeg failed to decode audio ({proc.returncode})")
+
+    while len(peaks) > WAVEFORM_PEAKS:
+        peaks = merge_peaks(peaks)
+
+    return [round(min(p, 32767) / 32767, 3) for p in peaks]
+
+
+def generate_previews(filename: str):
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in VIDEO_EXTS and ext not in AUDIO_EXTS:
+        return
+    if not os.path.exists(filepath) or load_preview_manifest(filename) is not None:
+        return
+
+    source_mtime = os.stat(filepath).st_mtime_ns
+    paths = preview_paths(filename)
+
+    try:
+        if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+            raise RuntimeError("ffmpeg/ffprobe not available")
+
+        info = probe_media(filepath)
+        if ext in VIDEO_EXTS and info["has_video"]:
+            manifest = generate_video_preview(filepath, paths, info)
+        elif info["has_audio"]:
+            manifest = {"type": "audio", "duration": info["duration"], "peaks": generate_waveform(filepath, info["duration"])}
+        else:
+            raise RuntimeError("No audio or video stream")
+    except Exception as e:
+        # Cache the failure so polling clients don't trigger a new ffmpeg run each time
+        print(f"Preview generation failed ({filename}): {e}")
+        manifest = {"error": str(e)}
+
+    manifest["source_mtime"] = source_mtime
+    write_preview_manifest(filename, manifest)
+    if "error" not in manifest:
+        print(f"Previews generated: {filename}")
+
+
+def queue_previews(filename: str):
+    library_worker.submit(f"preview:{filename}", generate_previews, filename)
+
+
+# --- CONTENT HASH INDEX (duplicate detection) ---
+# Same media often lands in DOWNLOAD_DIR several times under different names
+# (task_id prefix, custom title + timestamp). Each file is hashed once and
+# exact duplicates are hardlinked together to reclaim disk space.
+LIBRARY_INDEX_PATH = os.path.join(DOWNLOAD_DIR, ".library_index.json")
+HASH_CHUNK_SIZE = 1024 * 1024
+INDEX_SAVE_DELAY = 5  # seconds: batch index writes during backfills
+DEDUP_HARDLINK = os.getenv("DEDUP_HARDLINK", "1") != "0"
+
+
+def hash_file(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LibraryIndex:
+    """Persistent { filename: { size, mtime, sha256, created } } map stored as JSON next to the downloads.
+
+    An entry is only trusted while the file's size and mtime still match,
+    so edited or replaced files are simply hashed again. `created` is the
+    download time captured on first indexing: once files can be hardlinked,
+    st_ctime (bumped by every link) and st_mtime (shared by every name) no
+    longer say when a file arrived.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        self.save_timer: Optional[threading.Timer] = None
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        # sha256 -> filenames, so duplicate lookups only stat files sharing a hash
+        self.by_hash: Dict[str, set] = {}
+        for filename, entry in self.entries.items():
+            self.by_hash.setdefault(entry["sha256"], set()).add(filename)
+
+    def _unlink_hash(self, filename: str):
+        # Caller holds self.lock
+        entry = self.entries.get(filename)
+        if entry:
+            names = self.by_hash.get(entry["sha256"], set())
+            names.discard(filename)
+            if not names:
+                self.by_hash.pop(entry["sha256"], None)
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def _schedule_save(self):
+        # Caller holds self.lock. One write per INDEX_SAVE_DELAY instead of one per record.
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(INDEX_SAVE_DELAY, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.save_timer = None
+            self._save()
+
+    def lookup(self, filename: str, stat: os.stat_result) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        return None
+
+    def created(self, filename: str) -> Optional[float]:
+        with self.lock:
+            entry = self.entries.get(filename)
+        return entry.get("created") if entry else None
+
+    def record(self, filename: str, stat: os.stat_result, sha256: str):
+        with self.lock:
+            previous = self.entries.get(filename) or {}
+            self._unlink_hash(filename)
+            self.by_hash.setdefault(sha256, set()).add(filename)
+            self.entries[filename] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": sha256,
+                "created": previous.get("created", stat.st_ctime),
+            }
+            self._schedule_save()
+
+    def remove(self, filename: str):
+        with self.lock:
+            self._unlink_hash(filename)
+            if self.entries.pop(filename, None) is not None:
+                self._schedule_save()
+
+    def valid_entries(self, filenames) -> Dict[str, tuple]:
+        """{ filename: (sha256, stat) } pour les fichiers donnés encore présents et à jour."""
+        with self.lock:
+            entries = {f: self.entries[f] for f in filenames if f in self.entries}
+        result = {}
+        for filename, entry in entries.items():
+            try:
+                stat = os.stat(os.path.join(DOWNLOAD_DIR, filename))
+            except OSError:
+                continue
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                result[filename] = (entry["sha256"], stat)
+        return result
+
+    def same_hash(self, sha256: str) -> Dict[str, tuple]:
+        with self.lock:
+            names = set(self.by_hash.get(sha256, ()))
+        return self.valid_entries(names)
+
+    def duplicate_groups(self) -> List[dict]:
+        # Only files whose hash is shared by another entry need a stat
+        with self.lock:
+            candidates = [f for names in self.by_hash.values() if len(names) > 1 for f in names]
+
+        by_hash: Dict[str, list] = {}
+        for filename, (sha256, stat) in self.valid_entries(candidates).items():
+            if stat.st_size:
+                by_hash.setdefault(sha256, []).append((filename, stat))
+
+        groups = []
+        for sha256, members in by_hash.items():
+            if len(members) < 2:
+                continue
+            inodes = {(stat.st_dev, stat.st_ino) for _, stat in members}
+            size = members[0][1].st_size
+            groups.append({
+                "hash": sha256,
+                "size": size,
+                "files": sorted(filename for filename, _ in members),
+                "linked": len(inodes) == 1,
+                "reclaimable": size * (len(inodes) - 1),
+            })
+        groups.sort(key=lambda g: g["reclaimable"], reverse=True)
+        return groups
+
+library_index = LibraryIndex(LIBRARY_INDEX_PATH)
+
+# Per-file locks: serialize hashing/relinking (library worker) with in-place tag edits (/api/metadata)
+file_locks: Dict[str, threading.Lock] = {}
+file_locks_guard = threading.Lock()
+
+
+def file_lock(filename: str) -> threading.Lock:
+    with file_locks_guard:
+        return file_locks.setdefault(filename, threading.Lock())
+
+
+def same_content_stat(a: os.stat_result, b: os.stat_result) -> bool:
+    return (a.st_size, a.st_mtime_ns) == (b.st_size, b.st_mtime_ns)
+
+
+def link_duplicate(original: str, duplicate: str, original_stat: os.stat_result, duplicate_stat: os.stat_result) -> bool:
+    """Remplace `duplicate` par un hardlink vers `original` (les deux noms restent valides).
+
+    Both files must still match the stats they were hashed with, otherwise
+    the link is skipped (e.g. tags written to either file in the meantime).
+    """
+    src = os.path.join(DOWNLOAD_DIR, original)
+    dst = os.path.join(DOWNLOAD_DIR, duplicate)
+    tmp = dst + ".dedup.tmp"
+    try:
+        os.link(src, tmp)
+        if not same_content_stat(os.stat(tmp), original_stat) or not same_content_stat(os.stat(dst), duplicate_stat):
+            os.remove(tmp)
+            return False
+        os.replace(tmp, dst)
+        return True
+    except OSError as e:
+        print(f"Dedup link failed ({duplicate} -> {original}): {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+
+def unshare_file(filepath: str):
+    """Give a hardlinked file its own copy so in-place edits don't leak into its duplicates."""
+    if os.stat(filepath).st_nlink > 1:
+        tmp = filepath + ".unshare.tmp"
+        shutil.copy2(filepath, tmp)
+        os.replace(tmp, filepath)
+
+
+def index_file(filename: str):
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    with file_lock(filename):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return
+
+        sha256 = library_index.lookup(filename, stat)
+        if sha256 is None:
+            sha256 = hash_file(filepath)
+            if not same_content_stat(os.stat(filepath), stat):
+                return  # Modified while hashing, will be picked up again later
+            library_index.record(filename, stat, sha256)
+
+    if not DEDUP_HARDLINK or not stat.st_size:
+        return
+
+    for other, (other_hash, other_stat) in library_index.same_hash(sha256).items():
+        if other == filename or other_hash != sha256 or other_stat.st_size != stat.st_size:
+            continue
+        if (other_stat.st_dev, other_stat.st_ino) == (stat.st_dev, stat.st_ino):
+            return  # Already linked
+        if other_stat.st_dev != stat.st_dev:
+            continue
+        # Lock both names in a fixed order so a concurrent tag edit can't be overwritten
+        first, second = sorted((filename, other))
+        with file_lock(first), file_lock(second):
+            if link_duplicate(other, filename, other_stat, stat):
+                library_index.record(filename, os.stat(filepath), sha256)
+                print(f"Duplicate linked: {filename} -> {other}")
+        return
+
+
+def queue_hash(filename: str):
+    library_worker.submit(f"hash:{filename}", index_file, filename)
+
+
 # --- BACKGROUND DOWNLOAD WORKER ---
 def background_download(task_id: str, url: str, format_id: str, custom_title: str, start_time: int = 0, end_time: int = 0):
     task = download_tasks[task_id]
@@ -489,6 +1115,10 @@ def background_download(task_id: str, url: str, format_id: str, custom_title: st
             }))
             loop.close()
 
+            # Hash (and dedup) first, then generate seek previews / waveform once downloads go idle
+            queue_hash(task['filename'])
+            queue_previews(task['filename'])
+
     except Exception as e:
         print(f"Download Error: {e}")
         task['status'] = 'error'
@@ -514,6 +1144,7 @@ async def prepare_download(url: str, format_id: str, title: str, start: int = 0,
     for k in toremove:
         if k in download_tasks:
             del download_tasks[k]
+        progress_hub.forget(k)
 
     task_id = str(uuid.uuid4())
     download_tasks[task_id] = {
@@ -542,12 +1173,76 @@ async def prepare_download(url: str, format_id: str, title: str, start: int = 0,
     return {"task_id": task_id}
 
 
+TERMINAL_STATUSES = ("finished", "error")
+
+
+def progress_payload(task_id: str) -> Optional[dict]:
+    """Task dict + latest progress event, the single shape for every progress endpoint."""
+    task = download_tasks.get(task_id)
+    if task is None:
+        return None
+    payload = dict(task)
+    payload.update(progress_hub.snapshot(task_id) or {})
+    payload.setdefault("version", 0)
+    return payload
+
+
 @app.get("/api/progress/{task_id}")
-async def get_progress(task_id: str):
+async def get_progress(task_id: str, since: Optional[int] = None, timeout: float = 25):
     task = download_tasks.get(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+
+    if since is not None:
+        # Long-poll: hold the request until the task moves past `since`
+        state = await progress_hub.wait(task_id, since, min(max(timeout, 0), 60))
+        if state is None:
+            return Response(status_code=204)
+
+    payload = progress_payload(task_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return payload
+
+
+@app.get("/api/progress/{task_id}/events")
+async def stream_progress(task_id: str, request: Request):
+    """Server-Sent Events: même flux que le WebSocket, filtré sur une tâche."""
+    if task_id not in download_tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    last_event_id = request.headers.get("last-event-id", "")
+    since = int(last_event_id) if last_event_id.isdigit() else 0
+
+    async def event_stream():
+        version = since
+        yield "retry: 3000\n\n"
+        while True:
+            if task_id not in download_tasks or await request.is_disconnected():
+                break
+            current = progress_hub.snapshot(task_id) or {}
+            if current.get("status") in TERMINAL_STATUSES and current.get("version", 0) <= version:
+                break
+
+            state = await progress_hub.wait(task_id, version, 15)
+            if state is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            version = state["version"]
+            payload = progress_payload(task_id)
+            if payload is None:
+                break
+            payload.update(state)
+            yield f"id: {version}\nevent: progress\ndata: {json.dumps(payload)}\n\n"
+            if state.get("status") in TERMINAL_STATUSES:
+                break
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/download/{task_id}")
@@ -578,15 +1273,82 @@ class MetadataRequest(BaseModel):
     album: str
     cover_url: Optional[str] = None
 
+METADATA_EXTS = [".mp3", ".mp4", ".m4a"]
+
+
+def write_tags(filepath: str, data: MetadataRequest, cover_data: Optional[bytes]):
+    """Écrit les tags sous le verrou du fichier (appelé hors de l'event loop).
+
+    Lock, unshare and save all happen in this thread, so a cancelled request
+    can never leave the lock held.
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    try:
+        with file_lock(data.filename):
+            _write_tags_locked(filepath, ext, data, cover_data)
+    finally:
+        # Re-index even on failure: an unshared but unmodified copy must be relinked
+        queue_hash(data.filename)
+
+
+def _write_tags_locked(filepath: str, ext: str, data: MetadataRequest, cover_data: Optional[bytes]):
+    # Tags are written in place: detach from any deduplicated copies first
+    unshare_file(filepath)
+
+    # --- MP3 Handling ---
+    if ext == ".mp3":
+        try:
+            audio = MP3(filepath, ID3=ID3)
+        except:
+            audio = MP3(filepath)
+            audio.add_tags()
+        
+        # Simple tags via EasyID3 for text (safer)
+        # But Mutagen ID3 is needed for Cover
+        
+        # Write text tags manually to avoid EasyID3 complexity with existing tags
+        if audio.tags is None: audio.add_tags()
+        
+        audio.tags.add(TIT2(encoding=3, text=data.title))
+        audio.tags.add(TPE1(encoding=3, text=data.artist))
+        audio.tags.add(TALB(encoding=3, text=data.album))
+
+        if cover_data:
+            audio.tags.add(
+                APIC(
+                    encoding=3, # 3 is UTF-8
+                    mime='image/jpeg', # assume jpeg or png
+                    type=3, # 3 is for the cover image
+                    desc=u'Cover',
+                    data=cover_data
+                )
+            )
+        audio.save()
+
+    # --- MP4/M4A Handling ---
+    else:
+        video = MP4(filepath)
+        video["\xa9nam"] = data.title # Title
+        video["\xa9ART"] = data.artist # Artist
+        video["\xa9alb"] = data.album  # Album
+        
+        if cover_data:
+            video["covr"] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG if data.cover_url.endswith('jpg') or data.cover_url.endswith('jpeg') else MP4Cover.FORMAT_PNG)]
+        
+        video.save()
+
+
 @app.post("/api/metadata")
 async def update_metadata(data: MetadataRequest):
     filepath = os.path.join(DOWNLOAD_DIR, data.filename)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
 
+    # Reject before touching the file (unsharing a hardlinked duplicate for nothing)
+    if os.path.splitext(filepath)[1].lower() not in METADATA_EXTS:
+        raise HTTPException(status_code=400, detail="Unsupported file format for metadata editing")
+
     try:
-        ext = os.path.splitext(filepath)[1].lower()
-        
         # Helper to fetch cover image data
         cover_data = None
         if data.cover_url:
@@ -598,50 +1360,8 @@ async def update_metadata(data: MetadataRequest):
             except Exception as e:
                 print(f"Failed to fetch cover: {e}")
 
-        # --- MP3 Handling ---
-        if ext == ".mp3":
-            try:
-                audio = MP3(filepath, ID3=ID3)
-            except:
-                audio = MP3(filepath)
-                audio.add_tags()
-            
-            # Simple tags via EasyID3 for text (safer)
-            # But Mutagen ID3 is needed for Cover
-            
-            # Write text tags manually to avoid EasyID3 complexity with existing tags
-            if audio.tags is None: audio.add_tags()
-            
-            audio.tags.add(TIT2(encoding=3, text=data.title))
-            audio.tags.add(TPE1(encoding=3, text=data.artist))
-            audio.tags.add(TALB(encoding=3, text=data.album))
-
-            if cover_data:
-                audio.tags.add(
-                    APIC(
-                        encoding=3, # 3 is UTF-8
-                        mime='image/jpeg', # assume jpeg or png
-                        type=3, # 3 is for the cover image
-                        desc=u'Cover',
-                        data=cover_data
-                    )
-                )
-            audio.save()
-
-        # --- MP4/M4A Handling ---
-        elif ext in [".mp4", ".m4a"]:
-            video = MP4(filepath)
-            video["\xa9nam"] = data.title # Title
-            video["\xa9ART"] = data.artist # Artist
-            video["\xa9alb"] = data.album  # Album
-            
-            if cover_data:
-                video["covr"] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG if data.cover_url.endswith('jpg') or data.cover_url.endswith('jpeg') else MP4Cover.FORMAT_PNG)]
-            
-            video.save()
-            
-        else:
-             raise HTTPException(status_code=400, detail="Unsupported file format for metadata editing")
+        # Unshare (full file copy) + mutagen save run off the event loop
+        await asyncio.to_thread(write_tags, filepath, data, cover_data)
              
         # Rename file if title changed? (Optional, maybe risky if file is open. Let's just keep filename for now or do a safe rename)
         # For this version, we ONLY update internal tags. Renaming the actual physical file might break the frontend 'filename' reference if not careful.
@@ -667,11 +1387,9 @@ async def get_library():
                     stat = entry.stat()
                     # Detect type
                     ext = os.path.splitext(entry.name)[1].lower()
-                    if ext in ['.mp4', '.mkv', '.webm']:
+                    if ext in VIDEO_EXTS:
                         ftype = "video"
-                    elif ext in ['.mp3', '.m4a', '.wav']:
-                        ftype = "audio"
-                    elif ext in ['.mp3', '.m4a', '.wav']:
+                    elif ext in AUDIO_EXTS:
                         ftype = "audio"
                     else:
                         continue # Skip temp files or others
@@ -679,8 +1397,10 @@ async def get_library():
                     files.append({
                         "name": entry.name,
                         "size": stat.st_size,
-                        "created": stat.st_ctime,
-                        "type": ftype
+                        "created": library_index.created(entry.name) or stat.st_ctime,
+                        "type": ftype,
+                        "preview": preview_ready(entry.name, stat),
+                        "hash": library_index.lookup(entry.name, stat)
                     })
         # Sort by newest first
         files.sort(key=lambda x: x['created'], reverse=True)
@@ -699,12 +1419,41 @@ async def delete_library_item(filename: str):
     if os.path.exists(filepath):
         try:
             os.remove(filepath)
+            remove_previews(filename)
+            library_index.remove(filename)
             return {"status": "deleted"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     raise HTTPException(status_code=404, detail="File not found")
 
 
+@app.get("/api/library/duplicates")
+async def get_library_duplicates():
+    """Groupes de fichiers au contenu identique (sha256)."""
+    pending = 0
+    try:
+        with os.scandir(DOWNLOAD_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext not in VIDEO_EXTS and ext not in AUDIO_EXTS:
+                    continue
+                # Backfill files downloaded before hashing existed (or edited since)
+                if library_index.lookup(entry.name, entry.stat()) is None:
+                    queue_hash(entry.name)
+                    pending += 1
+
+        groups = library_index.duplicate_groups()
+        return {
+            "groups": groups,
+            "pending": pending,
+            "reclaimable": sum(g["reclaimable"] for g in groups)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/library/stream/{filename}")
 async def stream_library_item(filename: str):
     filepath = os.path.join(DOWNLOAD_DIR, filename)
@@ -717,6 +1466,55 @@ async def stream_library_item(filename: str):
 
     return FileResponse(filepath)
 
+
+@app.get("/api/library/preview/{filename}")
+async def get_library_preview(filename: str):
+    """Manifest des previews: poster + sprite sheet (vidéo) ou peaks (audio)."""
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    # Security check
+    if os.path.commonpath([filepath, DOWNLOAD_DIR]) != DOWNLOAD_DIR:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    manifest = load_preview_manifest(filename)
+    if manifest is None:
+        # Missing or stale (e.g. files downloaded before previews existed): queue it
+        queue_previews(filename)
+        raise HTTPException(status_code=404, detail="Preview not ready")
+    if "error" in manifest:
+        raise HTTPException(status_code=422, detail=f"Preview failed: {manifest['error']}")
+
+    manifest = dict(manifest)
+    manifest.pop("source_mtime", None)
+    return manifest
+
+
+@app.get("/api/library/preview/{filename}/{kind}")
+async def get_library_preview_image(filename: str, kind: str):
+    if kind not in ("poster", "sprite"):
+        raise HTTPException(status_code=404, detail="Unknown preview type")
+
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    # Security check
+    if os.path.commonpath([filepath, DOWNLOAD_DIR]) != DOWNLOAD_DIR:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    manifest = load_preview_manifest(filename)
+    if manifest is None:
+        if os.path.exists(filepath):
+            queue_previews(filename)
+        raise HTTPException(status_code=404, detail="Preview not ready")
+    if "error" in manifest:
+        raise HTTPException(status_code=422, detail=f"Preview failed: {manifest['error']}")
+
+    image_path = preview_paths(filename)[kind]
+    if not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail="Preview not available")
+
+    return FileResponse(image_path, media_type="image/jpeg")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file